@@ -1,8 +1,16 @@
 import os
 import argparse
+import glob
+import hashlib
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from itertools import repeat
 from PIL import Image
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from threadpoolctl import threadpool_limits
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
@@ -11,47 +19,75 @@ from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.lib import colors
 import webcolors
 
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Basic colors and their RGB values, stored as parallel arrays so the
+# nearest match can be found with a single vectorized distance
+_BASIC_NAMES = [
+    'red', 'green', 'blue', 'yellow', 'orange', 'purple', 'brown', 'pink',
+    'grey', 'black', 'white', 'tan', 'light blue', 'dark blue', 'light green',
+    'dark green', 'light grey', 'dark grey', 'navy', 'maroon'
+]
+_BASIC_RGB = np.array([
+    (255, 0, 0),
+    (0, 255, 0),
+    (0, 0, 255),
+    (255, 255, 0),
+    (255, 165, 0),
+    (128, 0, 128),
+    (165, 42, 42),
+    (255, 192, 203),
+    (128, 128, 128),
+    (0, 0, 0),
+    (255, 255, 255),
+    (210, 180, 140),
+    (173, 216, 230),
+    (0, 0, 139),
+    (144, 238, 144),
+    (0, 100, 0),
+    (211, 211, 211),
+    (169, 169, 169),
+    (0, 0, 128),
+    (128, 0, 0)
+], dtype=np.int16)
+
+# sRGB (D65) to CIE XYZ matrix and reference white
+_SRGB_TO_XYZ = np.array([
+    (0.4124564, 0.3575761, 0.1804375),
+    (0.2126729, 0.7151522, 0.0721750),
+    (0.0193339, 0.1191920, 0.9503041)
+])
+_D65_WHITE = np.array([0.95047, 1.0, 1.08883])
+
+def rgb_to_lab(rgb):
+    """
+    Convert 8-bit sRGB values (any shape ending in 3) to CIELab.
+    """
+    srgb = np.asarray(rgb, dtype=np.float64) / 255.0
+    linear = np.where(srgb <= 0.04045, srgb / 12.92, ((srgb + 0.055) / 1.055) ** 2.4)
+    xyz = linear @ _SRGB_TO_XYZ.T / _D65_WHITE
+    f = np.where(xyz > (6 / 29) ** 3, np.cbrt(xyz), xyz / (3 * (6 / 29) ** 2) + 4 / 29)
+    return np.stack([
+        116 * f[..., 1] - 16,
+        500 * (f[..., 0] - f[..., 1]),
+        200 * (f[..., 1] - f[..., 2])
+    ], axis=-1)
+
+# Basic colors in Lab space, so names match perceived rather than raw RGB distance
+_BASIC_LAB = rgb_to_lab(_BASIC_RGB)
+
+@lru_cache(maxsize=4096)
 def get_color_name(rgb):
     """
-    Get the closest matching color name for an RGB value.
-    """
-    def rgb_to_name(rgb_tuple):
-        # Dictionary of basic colors and their RGB values
-        basic_colors = {
-            'red': (255, 0, 0),
-            'green': (0, 255, 0),
-            'blue': (0, 0, 255),
-            'yellow': (255, 255, 0),
-            'orange': (255, 165, 0),
-            'purple': (128, 0, 128),
-            'brown': (165, 42, 42),
-            'pink': (255, 192, 203),
-            'grey': (128, 128, 128),
-            'black': (0, 0, 0),
-            'white': (255, 255, 255),
-            'tan': (210, 180, 140),
-            'light blue': (173, 216, 230),
-            'dark blue': (0, 0, 139),
-            'light green': (144, 238, 144),
-            'dark green': (0, 100, 0),
-            'light grey': (211, 211, 211),
-            'dark grey': (169, 169, 169),
-            'navy': (0, 0, 128),
-            'maroon': (128, 0, 0)
-        }
-        
-        min_distance = float('inf')
-        closest_color = 'unknown'
-        
-        for color_name, color_rgb in basic_colors.items():
-            distance = sum((c1 - c2) ** 2 for c1, c2 in zip(rgb_tuple, color_rgb))
-            if distance < min_distance:
-                min_distance = distance
-                closest_color = color_name
-                
-        return closest_color
-    
-    return rgb_to_name(tuple(rgb))
+    Get the closest matching color name for an RGB value, using CIE76
+    (Euclidean Lab) distance.
+    Expects a hashable (r, g, b) tuple so repeated palette colors are cached.
+    """
+    diff = _BASIC_LAB - rgb_to_lab(rgb)
+    return _BASIC_NAMES[int((diff * diff).sum(axis=1).argmin())]
 
 def load_and_resize_image(image_path, target_width, target_height):
     """
@@ -59,48 +95,102 @@ def load_and_resize_image(image_path, target_width, target_height):
     to maintain sharp edges suitable for pixel art.
     """
     with Image.open(image_path) as img:
-        if img.mode != 'RGB':
-            img = img.convert('RGB')
-        return img.resize((target_width, target_height), Image.Resampling.NEAREST)
+        # Resize first so only the small image is converted; nearest neighbor
+        # picks source pixels as-is, so the result is the same either way
+        small = img.resize((target_width, target_height), Image.Resampling.NEAREST)
+    if small.mode != 'RGB':
+        small = small.convert('RGB')
+    return small
 
 def create_high_res_pixel_art(small_image, target_size=1000):
     """
     Scale up the pixel art to a higher resolution while maintaining sharp edges.
-    Maintains aspect ratio while ensuring the longer side is target_size pixels.
+    Each pixel is repeated by the same integer factor so every cell comes out
+    the same size, with the longer side as close to target_size as possible.
     """
-    width, height = small_image.size
-    if width > height:
-        new_width = target_size
-        new_height = int(height * (target_size / width))
-    else:
-        new_height = target_size
-        new_width = int(width * (target_size / height))
-    
-    return small_image.resize((new_width, new_height), Image.Resampling.NEAREST)
+    factor = max(1, target_size // max(small_image.size))
+    pixels = np.asarray(small_image)
+    return Image.fromarray(np.repeat(np.repeat(pixels, factor, axis=0), factor, axis=1))
+
+# Distinct color count above which quantize_colors switches to MiniBatchKMeans.
+# K-means is fitted on distinct colors, which can't exceed width * height, so
+# this only kicks in for grids of roughly 224x224 and up; the usual 30x30 to
+# 50x50 grids always take the full-batch path.
+MINI_BATCH_THRESHOLD = 50_000
+
+# Default number of colors in each palette
+MAX_COLORS = 8
 
-def quantize_colors(image, max_colors=8):
+def quantize_colors(image, max_colors=MAX_COLORS):
     """
     Reduce the number of colors in the image using K-means clustering.
     Returns the quantized image and the palette of colors used.
     """
-    pixels = np.array(image)
-    original_shape = pixels.shape
+    # Stay in uint8 end-to-end to avoid widening copies of the image
+    pixels = np.asarray(image, dtype=np.uint8)
+    if not pixels.flags.c_contiguous:
+        pixels = np.ascontiguousarray(pixels)
     pixels_2d = pixels.reshape(-1, 3)
     
-    unique_colors = np.unique(pixels_2d, axis=0)
-    n_colors = min(len(unique_colors), max_colors)
-    
-    kmeans = KMeans(n_clusters=n_colors, random_state=42)
-    kmeans.fit(pixels_2d)
+    # Cluster the distinct colors weighted by how often they occur; this gives
+    # the same result as clustering every pixel but with far fewer points
+    unique_colors, inverse, counts = np.unique(
+        pixels_2d, axis=0, return_inverse=True, return_counts=True
+    )
+    inverse = inverse.ravel()
     
-    palette = kmeans.cluster_centers_.astype(int)
-    quantized_pixels = kmeans.predict(pixels_2d)
+    if len(unique_colors) <= max_colors:
+        # Already few enough colors (common for pixel art), so use them as-is
+        palette_u8 = unique_colors.astype(np.uint8)
+        quantized_pixels = inverse
+    else:
+        # float32 halves memory traffic versus the default float64;
+        # weights must match so they aren't upcast separately
+        features = unique_colors.astype(np.float32, copy=False)
+        weights = counts.astype(np.float32)
+        
+        if faiss is not None:
+            # FAISS has a SIMD/multithreaded Lloyd's that is much faster in 3-D.
+            # By default it subsamples to 256 points per centroid, which could
+            # drop heavily weighted colors, so train on every distinct color.
+            kmeans = faiss.Kmeans(
+                3, max_colors, niter=20, seed=42, verbose=False,
+                max_points_per_centroid=len(features),
+                min_points_per_centroid=1
+            )
+            kmeans.train(features, weights=weights)
+            centers = kmeans.centroids
+            _, labels = kmeans.index.search(features, 1)
+            labels = labels.ravel()
+        else:
+            # Full-batch K-means is overkill for large inputs; mini-batches
+            # converge to a near-identical palette far faster
+            if len(unique_colors) > MINI_BATCH_THRESHOLD:
+                kmeans = MiniBatchKMeans(
+                    n_clusters=max_colors, random_state=42,
+                    batch_size=4096, n_init=3, max_iter=100
+                )
+            else:
+                # A single k-means++ run converges quickly for a few 3-D clusters
+                kmeans = KMeans(
+                    n_clusters=max_colors, n_init=1, init='k-means++',
+                    max_iter=50, tol=1e-3, random_state=42
+                )
+            kmeans.fit(features, sample_weight=weights)
+            centers = kmeans.cluster_centers_
+            # Fitted on exactly these points, so labels_ is already the
+            # nearest-center assignment for every distinct color
+            labels = kmeans.labels_
+        
+        # Keep the palette as uint8 so the gather below emits image bytes directly
+        palette_u8 = centers.round().astype(np.uint8)
+        quantized_pixels = labels[inverse]
+    palette = palette_u8.astype(int)
     
-    color_mapping = {i: i+1 for i in range(n_colors)}
-    color_grid = quantized_pixels.reshape(original_shape[:2])
-    number_grid = np.vectorize(color_mapping.get)(color_grid)
+    # Cluster labels are 0-based; the template numbers start at 1
+    number_grid = quantized_pixels.reshape(pixels.shape[:2]) + 1
     
-    quantized_image = Image.fromarray(np.uint8(palette[quantized_pixels].reshape(original_shape)))
+    quantized_image = Image.fromarray(palette_u8[quantized_pixels].reshape(pixels.shape))
     
     return number_grid, palette, quantized_image
 
@@ -126,22 +216,28 @@ def create_numbered_pdf(number_grid, palette, output_path, title):
     start_x = (8.5 * inch - (grid_width * cell_size)) / 2
     start_y = 10 * inch  # Start near top of page, leaving room for title
     
-    # Draw grid and numbers
+    # Font size only depends on cell size, so set it once for the whole grid
+    c.setFont("Helvetica", min(cell_size * 0.7, 10))
+    labels = number_grid.astype(str)
+    
+    # Precompute cell corners and number positions for every row and column
+    xs = start_x + np.arange(grid_width) * cell_size
+    ys = start_y - (np.arange(grid_height) + 1) * cell_size
+    text_xs = (xs + cell_size * 0.4).tolist()
+    text_ys = (ys + cell_size * 0.3).tolist()
+    xs = xs.tolist()
+    ys = ys.tolist()
+    
+    # Collect all cell borders into one path and draw numbers as we go
+    grid_path = c.beginPath()
     for i in range(grid_height):
         for j in range(grid_width):
-            # Draw cell borders
-            x = start_x + (j * cell_size)
-            y = start_y - ((i + 1) * cell_size)
-            c.rect(x, y, cell_size, cell_size)
+            # Add cell border
+            grid_path.rect(xs[j], ys[i], cell_size, cell_size)
             
             # Add number (centered in cell)
-            number = int(number_grid[i][j])
-            c.setFont("Helvetica", min(cell_size * 0.7, 10))
-            c.drawString(
-                x + (cell_size * 0.4),
-                y + (cell_size * 0.3),
-                str(number)
-            )
+            c.drawString(text_xs[j], text_ys[i], labels[i, j])
+    c.drawPath(grid_path, stroke=1, fill=0)
     
     # Add color key in multiple columns
     key_start_y = start_y - ((grid_height + 1) * cell_size)
@@ -153,68 +249,184 @@ def create_numbered_pdf(number_grid, palette, output_path, title):
     column_width = 2 * inch
     num_columns = (len(palette) + colors_per_column - 1) // colors_per_column
     
-    # Add color swatches and names in columns
-    for i, color in enumerate(palette):
+    # Work out where each key entry goes
+    positions = []
+    for i in range(len(palette)):
         column = i // colors_per_column
         row = i % colors_per_column
         
         x_pos = start_x + (column * column_width)
         y_pos = key_start_y - ((row + 1) * 20)
-        
-        # Draw number
-        c.setFont("Helvetica", 12)
+        positions.append((x_pos, y_pos))
+    
+    # Convert the palette to fill colors and names once, up front
+    fill_colors = [tuple(rgb) for rgb in (palette.astype(np.float32) / 255.0).tolist()]
+    color_names = [get_color_name(tuple(int(v) for v in color)) for color in palette]
+    
+    # Draw numbers and color names while the fill color is still black
+    for i, (color_name, (x_pos, y_pos)) in enumerate(zip(color_names, positions)):
         c.drawString(x_pos, y_pos, f"{i + 1}:")
-        
-        # Draw color swatch
-        c.setFillColorRGB(color[0]/255, color[1]/255, color[2]/255)
-        c.rect(x_pos + 30, y_pos - 2, 15, 15, fill=1)
-        
-        # Draw color name
-        c.setFillColorRGB(0, 0, 0)  # Reset to black
-        color_name = get_color_name(color)
         c.drawString(x_pos + 60, y_pos, color_name)
     
+    # Draw color swatches, only changing the fill color when it differs
+    last_color = None
+    for fill_color, (x_pos, y_pos) in zip(fill_colors, positions):
+        if fill_color != last_color:
+            c.setFillColorRGB(*fill_color)
+            last_color = fill_color
+        c.rect(x_pos + 30, y_pos - 2, 15, 15, fill=1)
+    c.setFillColorRGB(0, 0, 0)  # Reset to black
+    
     c.save()
 
+def _limit_worker_threads():
+    """
+    Keep each worker process single-threaded so BLAS/OpenMP pools inside
+    numpy and scikit-learn don't oversubscribe the cores between them.
+    The runtimes are already loaded by the time this runs, so the pools are
+    capped through threadpoolctl rather than environment variables.
+    """
+    threadpool_limits(limits=1)
+
+# Bump when the cached data or how it is computed changes
+CACHE_VERSION = 1
+
+def _clustering_backend():
+    """
+    Name the library used to build the palette, so switching it
+    (e.g. installing FAISS) invalidates cached results.
+    """
+    return 'faiss' if faiss is not None else 'sklearn'
+
+def _cache_path(image_path, width, height):
+    """
+    Get the cache file for an image at a given grid size. The key includes the
+    file's modification time so edited images are reprocessed, plus the
+    palette size and clustering backend. File names start with a hash of the
+    image path so older entries for the same image can be found and pruned.
+    """
+    path_hash = hashlib.sha1(image_path.encode()).hexdigest()
+    key = (
+        f"v{CACHE_VERSION}:{image_path}:{os.path.getmtime(image_path)}:"
+        f"{width}x{height}:{MAX_COLORS}:{_clustering_backend()}"
+    )
+    key_hash = hashlib.sha1(key.encode()).hexdigest()
+    return os.path.join('cache', f"{path_hash}-{key_hash}.npz")
+
+def _load_cached(cache_path):
+    """
+    Load a cached (number_grid, palette) pair, or return None if there is
+    no usable cache entry. Unreadable files are treated as a cache miss.
+    """
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        with np.load(cache_path) as cached:
+            return cached['number_grid'], cached['palette']
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+
+def _save_cached(cache_path, number_grid, palette):
+    """
+    Write a cache entry via a temporary file so an interrupted run never
+    leaves a truncated file at the final path, then remove older entries
+    for the same image so the cache doesn't grow with every edit or size.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        # mkstemp creates owner-only files; match the permissions of the
+        # script's other outputs instead
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0o666 & ~umask)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, number_grid=number_grid, palette=palette)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    
+    path_hash = os.path.basename(cache_path).split('-')[0]
+    for stale_path in glob.glob(os.path.join(cache_dir, f"{path_hash}-*.npz")):
+        if stale_path != cache_path:
+            try:
+                os.remove(stale_path)
+            except FileNotFoundError:
+                pass
+
+def _process_one(filename, width, height):
+    """
+    Create the high-res pixel art image and PDF template for a single file
+    in the pics directory.
+    """
+    base_name = os.path.splitext(filename)[0]
+    image_path = os.path.join('pics', filename)
+    
+    print(f"Processing {filename}...")
+    
+    # Reuse the quantized grid from an earlier run if the image hasn't changed
+    cache_path = _cache_path(image_path, width, height)
+    cached = _load_cached(cache_path)
+    if cached is not None:
+        number_grid, palette = cached
+        quantized_image = Image.fromarray(palette.astype(np.uint8)[number_grid - 1])
+    else:
+        # Create low-res pixel art
+        img = load_and_resize_image(image_path, width, height)
+        
+        # Quantize colors
+        number_grid, palette, quantized_image = quantize_colors(img)
+        _save_cached(cache_path, number_grid, palette)
+    
+    # Create high-res version
+    high_res_image = create_high_res_pixel_art(quantized_image)
+    
+    high_res_path = os.path.join('pixel_art', f"{base_name}_pixel_art.png")
+    pdf_path = os.path.join('templates', f"{base_name}_template.pdf")
+    
+    # Save high-res pixel art in the background while the PDF is built;
+    # PIL releases the GIL during PNG encoding
+    with ThreadPoolExecutor(max_workers=1) as io_pool:
+        save_future = io_pool.submit(high_res_image.save, high_res_path)
+        
+        # Create PDF template with title
+        create_numbered_pdf(number_grid, palette, pdf_path, base_name)
+        save_future.result()
+    
+    print(f"Created pixel art: {high_res_path}")
+    print(f"Created template: {pdf_path}")
+
 def process_directory(width, height):
     """
     Process all images in the pics directory and create corresponding
     high-res pixel art images and PDF templates.
+    Images are independent, so when there are several they are processed
+    in parallel, one worker per image up to the number of cores.
     """
     if not os.path.exists('pics'):
         raise Exception("Required 'pics' directory not found!")
     
     os.makedirs('pixel_art', exist_ok=True)
     os.makedirs('templates', exist_ok=True)
+    os.makedirs('cache', exist_ok=True)
     
     print(f"Processing images to {width}x{height} pixel art...")
     
-    for filename in os.listdir('pics'):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
-            base_name = os.path.splitext(filename)[0]
-            image_path = os.path.join('pics', filename)
-            
-            print(f"Processing {filename}...")
-            
-            # Create low-res pixel art
-            img = load_and_resize_image(image_path, width, height)
-            
-            # Quantize colors
-            number_grid, palette, quantized_image = quantize_colors(img)
-            
-            # Create high-res version
-            high_res_image = create_high_res_pixel_art(quantized_image)
-            
-            # Save high-res pixel art
-            high_res_path = os.path.join('pixel_art', f"{base_name}_pixel_art.png")
-            high_res_image.save(high_res_path)
-            
-            # Create PDF template with title
-            pdf_path = os.path.join('templates', f"{base_name}_template.pdf")
-            create_numbered_pdf(number_grid, palette, pdf_path, base_name)
-            
-            print(f"Created pixel art: {high_res_path}")
-            print(f"Created template: {pdf_path}")
+    filenames = [
+        filename for filename in os.listdir('pics')
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+    ]
+    
+    # A single image gets the whole machine (and a normal traceback)
+    if len(filenames) <= 1:
+        for filename in filenames:
+            _process_one(filename, width, height)
+        return
+    
+    max_workers = min(len(filenames), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_limit_worker_threads) as executor:
+        list(executor.map(_process_one, filenames, repeat(width), repeat(height)))
 
 def main():
     """